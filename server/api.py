@@ -2,11 +2,19 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 from PIL import Image 
+import io
 import json
+import re
+import time
+from collections import OrderedDict
 from datetime import datetime
+from threading import Lock
+
+from .trace import span
 
 load_dotenv()  # loads from .env in root
 chat=None
+chat_id=0  # bumped by start_chat() so cached answers never cross chat sessions
 SECRET_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_ID=os.getenv("MODEL_ID")
 INSTRUCTION=os.getenv("INSTRUCTIONS")
@@ -14,28 +22,197 @@ TIMESTAMP=""
 # Set your API key
 genai.configure(api_key=SECRET_KEY)
 llm_model = genai.GenerativeModel(MODEL_ID, system_instruction=INSTRUCTION)
+
+# ===== ANSWER CACHE =====
+# Repeated questions ("what am I looking at" at the same desk) skip Gemini
+# entirely. Keyed by the normalized transcription plus a perceptual hash of
+# the image; frames whose hash is within ANSWER_CACHE_MAX_DISTANCE bits of a
+# cached one count as the same scene.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "128"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_DISTANCE = int(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "6"))
+
+# Prompt classes whose answers must never be cached: they go stale immediately,
+# or (reading) depend on fine detail the 8x8 image hash cannot see, so one
+# page/label/screen would be read out for the next
+PROMPT_CLASSES = {
+  "time": re.compile(r"\b(time|clock|hour)\b"),
+  "date": re.compile(r"\b(date|today|tomorrow|yesterday|day is it)\b"),
+  "weather": re.compile(r"\b(weather|temperature|rain|forecast)\b"),
+  "news": re.compile(r"\b(news|latest|score|price|stock)\b"),
+  "reading": re.compile(r"\b(read|reading|text|say|says|saying|written|writing|label|sign|page|screen|menu)\b"),
+}
+NO_CACHE_CLASSES = {c.strip() for c in os.getenv("ANSWER_CACHE_SKIP", "time,date,weather,news,reading").split(",") if c.strip()}
+
+answer_cache = OrderedDict()  # ((chat_id, prompt), image_hash) -> (answer, stored_at)
+answer_cache_lock = Lock()
+cache_counters = {"hits": 0, "near_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0, "expired": 0}
+
+
+def normalize_prompt(prompt):
+  """Lowercase, drop punctuation (Whisper joins segments with ' , ') and collapse spaces."""
+  text = re.sub(r"[^\w\s]", " ", prompt.lower())
+  return " ".join(text.split())
+
+
+def prompt_class(prompt):
+  """Return the first PROMPT_CLASSES name matching the normalized prompt, or None."""
+  for name, pattern in PROMPT_CLASSES.items():
+    if pattern.search(prompt):
+      return name
+  return None
+
+
+def image_hash(image, hash_size=8):
+  """64-bit difference hash: robust to small exposure/JPEG changes between frames."""
+  small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+  pixels = list(small.getdata())
+  bits = 0
+  for row in range(hash_size):
+    for col in range(hash_size):
+      left = pixels[row * (hash_size + 1) + col]
+      right = pixels[row * (hash_size + 1) + col + 1]
+      bits = (bits << 1) | (left > right)
+  return bits
+
+
+def _cache_lookup(prompt, img_hash):
+  now = time.time()
+  with answer_cache_lock:
+    # Drop expired entries first so they neither hit nor hold LRU slots
+    for key in [k for k, (_, stored) in answer_cache.items() if now - stored > ANSWER_CACHE_TTL]:
+      del answer_cache[key]
+      cache_counters["expired"] += 1
+
+    # An exact hash always wins; otherwise take the closest frame within range
+    key = (prompt, img_hash)
+    if key not in answer_cache and img_hash is not None:
+      best_distance = ANSWER_CACHE_MAX_DISTANCE + 1
+      for cached_prompt, cached_hash in answer_cache:
+        if cached_prompt != prompt or cached_hash is None:
+          continue
+        distance = bin(cached_hash ^ img_hash).count("1")
+        if distance < best_distance:
+          key, best_distance = (cached_prompt, cached_hash), distance
+      if key in answer_cache:
+        cache_counters["near_hits"] += 1
+    if key not in answer_cache:
+      cache_counters["misses"] += 1
+      return None
+    answer_cache.move_to_end(key)
+    cache_counters["hits"] += 1
+    return answer_cache[key][0]
+
+
+def _cache_store(prompt, img_hash, answer):
+  with answer_cache_lock:
+    answer_cache[(prompt, img_hash)] = (answer, time.time())
+    answer_cache.move_to_end((prompt, img_hash))
+    while len(answer_cache) > ANSWER_CACHE_SIZE:
+      answer_cache.popitem(last=False)
+      cache_counters["evictions"] += 1
+
+
+def _cacheable(prompt):
+  if not ANSWER_CACHE_ENABLED:
+    return False
+  cls = prompt_class(prompt)
+  if cls in NO_CACHE_CLASSES:
+    with answer_cache_lock:
+      cache_counters["bypassed"] += 1
+    print(f"🚫 Answer cache skipped for '{cls}' prompt")
+    return False
+  return True
+
+
+def _cache_key(prompt):
+  # Inside a chat an answer can depend on earlier turns, so scope it to the session
+  return (chat_id if chat is not None else None, prompt)
+
+
+def _record_cached_turn(user_parts, answer):
+  """Append a cache-served turn to the chat so its history has no gaps."""
+  if chat is None:
+    return
+  chat.history = list(chat.history) + [
+    {"role": "user", "parts": user_parts},
+    {"role": "model", "parts": [answer]},
+  ]
+
+
+def cache_stats():
+  """Counters and hit rate for /health."""
+  with answer_cache_lock:
+    lookups = cache_counters["hits"] + cache_counters["misses"]
+    return dict(cache_counters,
+                enabled=ANSWER_CACHE_ENABLED,
+                size=len(answer_cache),
+                max_size=ANSWER_CACHE_SIZE,
+                ttl_s=ANSWER_CACHE_TTL,
+                hit_rate=(cache_counters["hits"] / lookups) if lookups else None)
+
+
+def clear_answer_cache():
+  with answer_cache_lock:
+    answer_cache.clear()
+
 print ("API setup is done ✅")
 
 
 def start_chat():
-  global chat
+  global chat, chat_id
   chat=llm_model.start_chat()
+  chat_id+=1
   TIMESTAMP=datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
   print("New chat started")
 
-def generate_image_response(image_loc,prompt):
-  image = Image.open(image_loc)
-  if chat is not   None:
-    response=chat.send_message([image, prompt]).text
-    return response
-  response=llm_model.generate_content([image, prompt]).text
+def prepare_image_input(image_data):
+  """Decode JPEG bytes into the model input up front; returns (image, image_hash)."""
+  image = Image.open(io.BytesIO(image_data))
+  image.load()
+  return image, image_hash(image)
+
+def generate_image_response(image_loc,prompt,img_hash=None):
+  # Accepts a file path or an already decoded image from prepare_image_input()
+  image = image_loc if isinstance(image_loc, Image.Image) else Image.open(image_loc)
+  key = normalize_prompt(prompt)
+  cacheable = _cacheable(key)
+  if cacheable:
+    key = _cache_key(key)
+    if img_hash is None:
+      img_hash = image_hash(image)
+    cached = _cache_lookup(key, img_hash)
+    if cached is not None:
+      print("⚡ Answer cache hit (image)")
+      _record_cached_turn([image, prompt], cached)
+      return cached
+  with span("gemini.request", image=True):
+    if chat is not   None:
+      response=chat.send_message([image, prompt]).text
+    else:
+      response=llm_model.generate_content([image, prompt]).text
+  if cacheable:
+    _cache_store(key, img_hash, response)
   return response
 
 def generate_prompt_response(prompt):
-  if chat is not  None:
-    response=chat.send_message(prompt).text
-    return response
-  response=llm_model.generate_content(prompt).text
+  key = normalize_prompt(prompt)
+  cacheable = _cacheable(key)
+  if cacheable:
+    key = _cache_key(key)
+    cached = _cache_lookup(key, None)
+    if cached is not None:
+      print("⚡ Answer cache hit (text)")
+      _record_cached_turn([prompt], cached)
+      return cached
+  with span("gemini.request", image=False):
+    if chat is not  None:
+      response=chat.send_message(prompt).text
+    else:
+      response=llm_model.generate_content(prompt).text
+  if cacheable:
+    _cache_store(key, None, response)
   return response
 
 def end_chat(loc):
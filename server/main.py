@@ -2,15 +2,18 @@ from flask import Flask, send_from_directory, render_template
 from flask_sock import Sock
 import time
 import os
+import io
 import json
 import traceback
 from threading import Lock
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Import your existing functions
-from .api import end_chat, start_chat, generate_image_response, generate_prompt_response
+from .api import end_chat, start_chat, generate_image_response, generate_prompt_response, prepare_image_input, cache_stats
 from .stt import speech_to_text
-from .tts import text_to_speech
+from .tts import text_to_speech, tts_stats
+from .trace import TRACE_ENABLED, start_trace, end_trace, span, current_trace, use_trace, list_traces, get_trace
 
 app = Flask(__name__)
 sock = Sock(app)
@@ -26,6 +29,10 @@ os.makedirs(RESPONSE_FOLDER, exist_ok=True)
 
 # Lock for thread safety
 upload_lock = Lock()
+chat_lock = Lock()
+
+# Workers for upload stages that run alongside the receive loop / inference
+stage_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="stage")
 
 # Global message queue for broadcasting
 message_queue = deque(maxlen=100)
@@ -82,6 +89,57 @@ def verify_jpeg_header(data):
     
     return True
 
+def submit_stage(fn, *args):
+    """Run fn on the stage pool, keeping spans under the current request's trace"""
+    trace = current_trace()
+    def run():
+        with use_trace(trace):
+            return fn(*args)
+    return stage_pool.submit(run)
+
+def ensure_chat():
+    """Start the chat session once; runs while the audio is still uploading"""
+    global chat_started
+    # Runs outside upload_lock, so a stage left over from an aborted upload
+    # must not race the next one into starting a second session
+    with chat_lock:
+        if not chat_started:
+            print("🚀 Starting new chat session...")
+            with span("chat.start"):
+                start_chat()
+            chat_started = True
+
+def prepare_image(image_data):
+    """Validate and decode the JPEG into the model input as soon as its bytes are in"""
+    with span("image.prepare", bytes=len(image_data)):
+        if not verify_jpeg_header(image_data):
+            print("⚠️ Invalid JPEG header")
+        else:
+            print("✅ Valid JPEG detected")
+        try:
+            return prepare_image_input(image_data)
+        except Exception as e:
+            print(f"⚠️ Image decode failed, continuing text only: {e}")
+            return None
+
+def save_file(filepath, data, label):
+    """Write and fsync data; returns True once the file is on disk"""
+    try:
+        with span(f"{label}.save", bytes=len(data)), open(filepath, "wb") as f:
+            with span(f"{label}.write"):
+                f.write(data)
+                f.flush()
+            with span(f"{label}.fsync"):
+                os.fsync(f.fileno())
+        
+        if os.path.exists(filepath):
+            print(f"💾 {label.capitalize()} saved: {filepath} ({os.path.getsize(filepath)/1024:.1f} KB)")
+            return True
+        print(f"⚠️ {label.capitalize()} save verification failed")
+    except Exception as e:
+        print(f"❌ {label.capitalize()} save error: {e}")
+    return False
+
 @sock.route('/broadcast')
 def broadcast(ws):
     """WebSocket endpoint for web clients to receive updates"""
@@ -106,6 +164,13 @@ def broadcast(ws):
 
 @sock.route('/upload')
 def upload(ws):
+    trace = start_trace("upload")
+    try:
+        handle_upload(ws)
+    finally:
+        end_trace(trace)
+
+def handle_upload(ws):
     print('=' * 50)
     print('✅ Client connected')
     print('=' * 50)
@@ -117,10 +182,12 @@ def upload(ws):
         expected_audio_size = 0
         image_filename = None
         audio_filename = None
+        stage_futures = []
         
         try:
             # ===== RECEIVE METADATA (image_size,audio_size) =====
-            metadata_msg = ws.receive(timeout=10)
+            with span("metadata.wait"):
+                metadata_msg = ws.receive(timeout=10)
             
             if not metadata_msg:
                 print("❌ No metadata received")
@@ -147,6 +214,16 @@ def upload(ws):
                 send_error_response(ws, "Invalid metadata format")
                 return
             
+            # ===== STAGE GRAPH =====
+            # Independent work starts as soon as its inputs exist: chat setup now
+            # (overlaps the upload), image prep + persistence once the image is in,
+            # audio persistence alongside STT. Only the model call waits on the transcript.
+            timestamp = int(time.time())
+            chat_future = submit_stage(ensure_chat)
+            stage_futures.append(chat_future)
+            image_future = None
+            image_save_future = None
+            
             # ===== RECEIVE IMAGE (if size > 0) =====
             image_data = None
             image_time = 0
@@ -157,12 +234,15 @@ def upload(ws):
                 image_chunks = []
                 image_received = 0
                 
-                time.sleep(0.1)
+                with span("image.sleep"):
+                    time.sleep(0.1)
                 
                 while image_received < expected_image_size:
                     try:
                         chunk_timeout = 10
-                        data = ws.receive(timeout=chunk_timeout)
+                        with span("image.chunk") as sp:
+                            data = ws.receive(timeout=chunk_timeout)
+                            sp.set(bytes=len(data) if data else 0)
                         
                         if data is None:
                             print(f"⚠️ Image receive timeout")
@@ -188,10 +268,11 @@ def upload(ws):
                     image_time = time.time() - t_image_start
                     print(f"📦 Image received: {len(image_data)/1024:.1f} KB in {image_time:.1f}s")
                     
-                    if not verify_jpeg_header(image_data):
-                        print("⚠️ Invalid JPEG header")
-                    else:
-                        print("✅ Valid JPEG detected")
+                    # Image is complete: decode it and persist it while audio streams in
+                    image_filename = f"image_{timestamp}.jpg"
+                    image_future = submit_stage(prepare_image, image_data)
+                    image_save_future = submit_stage(save_file, os.path.join(IMAGE_FOLDER, image_filename), image_data, "image")
+                    stage_futures += [image_future, image_save_future]
             
             # ===== RECEIVE AUDIO =====
             print(f'📥 Receiving audio...')
@@ -201,7 +282,8 @@ def upload(ws):
             audio_received = 0
             chunk_count = 0
             
-            time.sleep(0.1)
+            with span("audio.sleep"):
+                time.sleep(0.1)
             
             while True:
                 try:
@@ -216,7 +298,9 @@ def upload(ws):
                     else:
                         break
                     
-                    data = ws.receive(timeout=chunk_timeout)
+                    with span("audio.chunk", index=chunk_count) as sp:
+                        data = ws.receive(timeout=chunk_timeout)
+                        sp.set(bytes=len(data) if data else 0)
                     
                     if data is None:
                         print(f"⚠️ Audio timeout after {chunk_count} chunks")
@@ -266,49 +350,11 @@ def upload(ws):
             else:
                 print("✅ Valid WAV header detected")
             
-            # ===== SAVE FILES =====
-            timestamp = int(time.time())
-            
-            # Save image - FIXED: Use just filename, not full path
-            if image_data and len(image_data) > 0:
-                image_filename = f"image_{timestamp}.jpg"
-                image_filepath = os.path.join(IMAGE_FOLDER, image_filename)
-                try:
-                    with open(image_filepath, "wb") as f:
-                        f.write(image_data)
-                        f.flush()
-                        os.fsync(f.fileno())
-                    
-                    if os.path.exists(image_filepath):
-                        print(f"💾 Image saved: {image_filepath} ({os.path.getsize(image_filepath)/1024:.1f} KB)")
-                    else:
-                        print(f"⚠️ Image save verification failed")
-                        image_filename = None
-                        
-                except Exception as e:
-                    print(f"❌ Image save error: {e}")
-                    image_filename = None
-            
-            # Save audio - FIXED: Use just filename, not full path
+            # ===== SAVE AUDIO (in parallel with inference) =====
             audio_filename = f"audio_{timestamp}.wav"
             audio_filepath = os.path.join(AUDIO_FOLDER, audio_filename)
-            try:
-                with open(audio_filepath, "wb") as f:
-                    f.write(audio_data)
-                    f.flush()
-                    os.fsync(f.fileno())
-                
-                if os.path.exists(audio_filepath):
-                    print(f"💾 Audio saved: {audio_filepath} ({os.path.getsize(audio_filepath)/1024:.1f} KB)")
-                else:
-                    print(f"❌ Audio save verification failed")
-                    send_error_response(ws, "Audio save failed")
-                    return
-                    
-            except Exception as e:
-                print(f"❌ Audio save error: {e}")
-                send_error_response(ws, f"Audio save error: {str(e)}")
-                return
+            audio_save_future = submit_stage(save_file, audio_filepath, audio_data, "audio")
+            stage_futures.append(audio_save_future)
             
             # FIXED: Response audio filename
             response_filename = f"response_{timestamp}.wav"
@@ -317,16 +363,18 @@ def upload(ws):
             # ===== PROCESS AUDIO AND IMAGE =====
             print(f"🤖 Processing audio and image...")
             processing_start = time.time()
-            global chat_started
-            if not chat_started:
-                print("🚀 Starting new chat session...")
-                start_chat()
-                chat_started = True
             try:
-                # Transcribe audio
-                transcribe = speech_to_text(audio_filepath)
+                # Transcribe audio straight from memory; the disk copy is written concurrently
+                with span("stt"):
+                    transcribe = speech_to_text(io.BytesIO(audio_data))
                 print(f"📝 Transcription: {transcribe[:100]}...")
                 
+                # Web clients load the image by URL, so it must be on disk before broadcasting
+                if image_save_future is not None:
+                    with span("image.save.wait"):
+                        if not image_save_future.result():
+                            image_filename = None
+                
                 # BROADCAST TRANSCRIPTION TO WEB CLIENTS - FIXED: Use correct URL format
                 image_url = f"/images/{image_filename}" if image_filename else None
                 print(f"🖼️ Broadcasting image URL: {image_url}")
@@ -341,19 +389,27 @@ def upload(ws):
                     "timestamp": time.time()
                 })
                 
+                # Chat session and image input were prepared during the upload
+                with span("stages.wait"):
+                    chat_future.result()
+                    image_input = image_future.result() if image_future is not None else None
+                
                 # Generate response with image (if available)
-                if image_filename and os.path.exists(os.path.join(IMAGE_FOLDER, image_filename)):
-                    image_full_path = os.path.join(IMAGE_FOLDER, image_filename)
-                    print(f"🖼️ Processing with image context: {image_full_path}")
-                    response_text = generate_image_response(image_full_path, transcribe)
+                if image_input is not None:
+                    image, image_hash = image_input
+                    print(f"🖼️ Processing with image context: {image_filename or 'unsaved image'}")
+                    with span("llm", image=True):
+                        response_text = generate_image_response(image, transcribe, image_hash)
                 else:
                     print(f"💬 Processing text only...")
-                    response_text = generate_prompt_response(transcribe)
+                    with span("llm", image=False):
+                        response_text = generate_prompt_response(transcribe)
                 
                 print(f"💬 Response: {response_text[:100]}...")
                 
                 # Convert to speech
-                text_to_speech(response_text, RESPONSE_AUDIO)
+                with span("tts", chars=len(response_text)):
+                    text_to_speech(response_text, RESPONSE_AUDIO)
                 
                 # Verify the response audio was created
                 if not os.path.exists(RESPONSE_AUDIO):
@@ -363,11 +419,16 @@ def upload(ws):
                     print(f"✅ Response audio created: {RESPONSE_AUDIO} ({audio_file_size/1024:.1f} KB)")
                 
                 # Small delay to ensure file is fully written
-                time.sleep(0.2)
+                with span("tts.sleep"):
+                    time.sleep(0.2)
                 
                 processing_time = time.time() - processing_start
                 print(f"✅ Processing complete ({processing_time:.1f}s)")
                 
+                with span("audio.save.wait"):
+                    if not audio_save_future.result():
+                        print(f"⚠️ Audio recording was not persisted: {audio_filepath}")
+                
                 # BROADCAST RESPONSE TO WEB CLIENTS - FIXED: Use correct URL format
                 audio_url = f"/audio/{response_filename}"
                 print(f"🔊 Broadcasting audio URL: {audio_url}")
@@ -413,8 +474,10 @@ def upload(ws):
             }
             
             try:
-                ws.send(json.dumps(response))
-                time.sleep(0.1)
+                with span("send.metadata"):
+                    ws.send(json.dumps(response))
+                with span("send.metadata.sleep"):
+                    time.sleep(0.1)
                 
             except Exception as e:
                 print(f"❌ Metadata send failed: {e}")
@@ -426,21 +489,24 @@ def upload(ws):
             send_chunk_count = 0
             
             try:
-                with open(RESPONSE_AUDIO, "rb") as f:
+                with span("send", bytes=audio_size), open(RESPONSE_AUDIO, "rb") as f:
                     while True:
                         chunk = f.read(SEND_CHUNK_SIZE)
                         if not chunk:
                             break
                         
-                        ws.send(chunk)
+                        with span("send.chunk", index=send_chunk_count, bytes=len(chunk)):
+                            ws.send(chunk)
                         sent_bytes += len(chunk)
                         send_chunk_count += 1
                         
-                        time.sleep(0.01)
+                        with span("send.chunk.sleep"):
+                            time.sleep(0.01)
                 
                 send_time = time.time() - send_start
                 print(f"✅ Response sent: {sent_bytes/1024:.1f} KB in {send_time:.1f}s ({sent_bytes/send_time/1024:.1f} KB/s)")
-                time.sleep(0.7)
+                with span("send.tail.sleep"):
+                    time.sleep(0.7)
                 
             except Exception as e:
                 print(f"❌ Send error: {e}")
@@ -462,6 +528,10 @@ def upload(ws):
                 pass
         
         finally:
+            # Early returns leave stages running; finish them before the
+            # trace closes and the next upload takes the lock
+            if stage_futures:
+                wait(stage_futures)
             print(f"🔌 Client disconnected\n")
 
 @app.route('/chat')
@@ -586,6 +656,20 @@ def index():
 </body>
 </html>'''
 
+@app.route('/traces')
+def traces():
+    """List recent upload traces (newest first)"""
+    return {"enabled": TRACE_ENABLED, "traces": list_traces()}
+
+@app.route('/traces/latest')
+@app.route('/traces/<int:trace_id>')
+def trace_export(trace_id=None):
+    """Chrome trace-event JSON for one upload (load in chrome://tracing or ui.perfetto.dev)"""
+    trace = get_trace(trace_id)
+    if trace is None:
+        return {"error": "Trace not found"}, 404
+    return trace.to_chrome()
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
@@ -599,7 +683,9 @@ def health():
         "optimizations": {
             "receive_chunk_size": RECEIVE_CHUNK_SIZE,
             "send_chunk_size": SEND_CHUNK_SIZE
-        }
+        },
+        "tts": tts_stats(),
+        "answer_cache": cache_stats()
     }
 
 if __name__ == '__main__':
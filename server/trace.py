@@ -0,0 +1,280 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+# Per-request tracing of the upload pipeline, exported as Chrome trace-event
+# JSON (open in chrome://tracing or https://ui.perfetto.dev).
+# Off by default; when off, span() hands back a shared no-op object.
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0") == "1"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "20"))
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "0") == "1"
+TRACE_PROFILE_INTERVAL_MS = float(os.getenv("TRACE_PROFILE_INTERVAL_MS", "5"))
+
+_PID = os.getpid()
+_local = threading.local()
+_trace_ids = itertools.count(1)
+
+# Ring buffer of the most recent finished traces
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+traces_lock = Lock()
+
+
+class _NullSpan:
+    """Returned by span() when tracing is off or no trace is active."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "args", "start_ns")
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.trace.add_event(self.name, self.start_ns, end_ns - self.start_ns, self.args)
+        return False
+
+    def set(self, **args):
+        """Attach extra args (sizes, counts, ...) once they are known."""
+        self.args.update(args)
+
+
+class Sampler(threading.Thread):
+    """Wall-clock stack sampler feeding a trace's stackFrames/samples.
+
+    Samples the request thread plus any thread that joins the trace through
+    use_trace() (the stage pool), for as long as it is working for the trace.
+    Work in other processes (pyttsx3 engines) is not sampled.
+    """
+
+    def __init__(self, trace, target_tid, interval_s):
+        super().__init__(name=f"trace-sampler-{trace.id}", daemon=True)
+        self.trace = trace
+        self.tids = {target_tid: 1}
+        self.tids_lock = Lock()
+        self.interval_s = interval_s
+        self.stopped = threading.Event()
+        self.frame_ids = {}
+        self.stack_frames = {}
+        self.samples = []
+
+    def _frame_id(self, key, parent):
+        node = (key, parent)
+        frame_id = self.frame_ids.get(node)
+        if frame_id is None:
+            frame_id = len(self.frame_ids) + 1
+            self.frame_ids[node] = frame_id
+            filename, firstlineno, func = key
+            entry = {"name": f"{func} ({os.path.basename(filename)}:{firstlineno})", "category": "python"}
+            if parent is not None:
+                entry["parent"] = parent
+            self.stack_frames[frame_id] = entry
+        return frame_id
+
+    def add_thread(self, tid):
+        with self.tids_lock:
+            self.tids[tid] = self.tids.get(tid, 0) + 1
+
+    def remove_thread(self, tid):
+        with self.tids_lock:
+            if self.tids.get(tid, 0) <= 1:
+                self.tids.pop(tid, None)
+            else:
+                self.tids[tid] -= 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval_s):
+            with self.tids_lock:
+                tids = list(self.tids)
+            frames = sys._current_frames()
+            ts = (time.perf_counter_ns() - self.trace.start_ns) / 1000
+            for tid in tids:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    # Key by function, not current line, so samples in one function merge
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                parent = None
+                for key in reversed(stack):
+                    parent = self._frame_id(key, parent)
+                self.samples.append({"cpu": 0, "tid": tid, "ts": ts, "name": "sample", "sf": parent, "weight": 1})
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=1)
+
+
+class Trace:
+    def __init__(self, name, args):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.args = args
+        self.wall_start = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.events = []
+        self.thread_names = {}
+        self.sampler = None
+        self.lock = Lock()
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def add_event(self, name, start_ns, dur_ns, args):
+        tid = threading.get_ident()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start_ns - self.start_ns) / 1000,
+            "dur": dur_ns / 1000,
+            "pid": _PID,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+
+    def finish(self):
+        self.end_ns = time.perf_counter_ns()
+        self.add_event(self.name, self.start_ns, self.end_ns - self.start_ns, self.args)
+
+    @property
+    def duration_s(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "start": self.wall_start,
+            "duration_s": round(self.duration_s, 4),
+            "spans": len(self.events),
+            "profiled": self.sampler is not None,
+        }
+
+    def to_chrome(self):
+        """Chrome trace-event JSON object (traceEvents + optional stackFrames/samples)."""
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        meta = [{"name": "process_name", "ph": "M", "pid": _PID, "args": {"name": "auralens-server"}}]
+        meta += [{"name": "thread_name", "ph": "M", "pid": _PID, "tid": tid, "args": {"name": tname}}
+                 for tid, tname in thread_names.items()]
+        out = {
+            "traceEvents": meta + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.id, "name": self.name, "start": self.wall_start},
+        }
+        if self.sampler is not None:
+            out["stackFrames"] = {str(k): v for k, v in self.sampler.stack_frames.items()}
+            out["samples"] = [dict(s, sf=str(s["sf"])) for s in self.sampler.samples]
+        return out
+
+
+def start_trace(name, **args):
+    """Begin a trace bound to the calling thread. Returns None when tracing is off."""
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(name, args)
+    _local.trace = trace
+    if TRACE_PROFILE:
+        trace.sampler = Sampler(trace, threading.get_ident(), TRACE_PROFILE_INTERVAL_MS / 1000)
+        trace.sampler.start()
+    return trace
+
+
+def end_trace(trace):
+    """Close the trace and push it into the ring buffer."""
+    if trace is None:
+        return
+    if trace.sampler is not None:
+        trace.sampler.stop()
+    trace.finish()
+    if getattr(_local, "trace", None) is trace:
+        _local.trace = None
+    with traces_lock:
+        recent_traces.append(trace)
+    print(f"🧭 Trace {trace.id} recorded ({trace.duration_s:.2f}s, {len(trace.events)} spans)")
+
+
+def current_trace():
+    return getattr(_local, "trace", None) if TRACE_ENABLED else None
+
+
+@contextmanager
+def use_trace(trace):
+    """Bind `trace` to the calling thread, e.g. for stages run on a worker pool."""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    sampler = trace.sampler if trace is not None else None
+    if sampler is not None:
+        sampler.add_thread(threading.get_ident())
+    try:
+        yield trace
+    finally:
+        if sampler is not None:
+            sampler.remove_thread(threading.get_ident())
+        _local.trace = previous
+
+
+def span(name, **args):
+    """Time a block as a child of the current thread's trace (no-op when off)."""
+    if not TRACE_ENABLED:
+        return NULL_SPAN
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, args)
+
+
+def list_traces():
+    with traces_lock:
+        return [t.summary() for t in reversed(recent_traces)]
+
+
+def get_trace(trace_id=None):
+    """Return a finished trace by id, or the newest one when trace_id is None."""
+    with traces_lock:
+        if not recent_traces:
+            return None
+        if trace_id is None:
+            return recent_traces[-1]
+        for trace in recent_traces:
+            if trace.id == trace_id:
+                return trace
+    return None
@@ -1,16 +1,261 @@
-from gtts import gTTS
+import io
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
 from pydub import AudioSegment
 
-text = "Hello Ritish, this is a test using gTTS!"
+from .trace import span
 
-print ("TTS setup is done ✅")
+# "gtts" goes to Google over the network, "pyttsx3" runs eSpeak-NG/SAPI5/NSSS in-process
+TTS_BACKEND = os.getenv("TTS_BACKEND", "gtts").lower()
+TTS_LANG = os.getenv("TTS_LANG", "hi")
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))
+TTS_RATE = os.getenv("TTS_RATE")
+TTS_VOICE = os.getenv("TTS_VOICE")
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_worker.py")
+
+# Output format expected by the ESP32 / MAX98357 side
+OUTPUT_FRAME_RATE = 16000
+OUTPUT_SAMPLE_WIDTH = 2
+
+
+class TTSBackend:
+  """Base class for speech backends. Subclasses return a pydub AudioSegment."""
+  name = "base"
+
+  def synthesize(self, text):
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+
+class GTTSBackend(TTSBackend):
+  """Cloud backend: one HTTPS round trip to Google per call."""
+  name = "gtts"
+
+  def __init__(self, lang=TTS_LANG):
+    from gtts import gTTS
+    self._gTTS = gTTS
+    self.lang = lang
+
+  def synthesize(self, text):
+    # Keep the mp3 in memory so concurrent calls don't fight over one file
+    buf = io.BytesIO()
+    self._gTTS(text=text, lang=self.lang, slow=False).write_to_fp(buf)
+    buf.seek(0)
+    return AudioSegment.from_file(buf, format="mp3")
+
+
+def _default_driver():
+  # Same platform defaults pyttsx3 uses when no driver name is given
+  if sys.platform == "win32":
+    return "sapi5"
+  if sys.platform == "darwin":
+    return "nsss"
+  return "espeak"
+
+
+class EngineProcess:
+  """One pyttsx3 engine running in its own process (see tts_worker.py).
+
+  eSpeak keeps its synth callback, voice and rate in process-wide state, so
+  engines can only run side by side in separate processes. A process that
+  hangs can also be killed and replaced, which a thread cannot.
+  """
+
+  def __init__(self, config, index, timeout):
+    self.index = index
+    self.timeout = timeout
+    self.proc = subprocess.Popen(
+      [sys.executable, WORKER_SCRIPT, json.dumps(config)],
+      stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1)
+    # Pipes have no portable read timeout, so a reader thread feeds a queue
+    self._replies = queue.Queue()
+    threading.Thread(target=self._read_replies, name=f"tts-engine-{index}-reader", daemon=True).start()
+    reply = self._wait()
+    if reply["status"] != "ready":
+      self.kill()
+      raise RuntimeError(f"pyttsx3 engine failed to start: {reply.get('error')}")
+
+  def _read_replies(self):
+    for line in self.proc.stdout:
+      try:
+        self._replies.put(json.loads(line))
+      except ValueError:
+        print(f"⚠️ pyttsx3 engine {self.index}: {line.rstrip()}")
+    self._replies.put({"status": "error", "error": f"engine process exited ({self.proc.wait()})"})
+
+  def _wait(self):
+    try:
+      return self._replies.get(timeout=self.timeout)
+    except queue.Empty:
+      self.kill()
+      raise TimeoutError(f"pyttsx3 engine {self.index} timed out after {self.timeout:.0f}s")
+
+  def run(self, text, wav_path):
+    self.proc.stdin.write(json.dumps({"text": text, "path": wav_path}) + "\n")
+    self.proc.stdin.flush()
+    reply = self._wait()
+    if reply["status"] != "ok":
+      raise RuntimeError(f"pyttsx3 synthesis failed: {reply.get('error')}")
+
+  @property
+  def alive(self):
+    return self.proc.poll() is None
 
-def text_to_speech(text,response_audio_path):
-  tts = gTTS(text=text, lang='hi',slow=False)
-  tts.save("output.mp3")
-  sound = AudioSegment.from_mp3("output.mp3")
-  sound = sound.set_frame_rate(16000).set_sample_width(2)
-  sound.export(response_audio_path, format="wav")
+  def kill(self):
+    if self.alive:
+      self.proc.kill()
+    self.proc.wait()
 
-  return 
-   
\ No newline at end of file
+  def close(self):
+    try:
+      self.proc.stdin.close()
+      self.proc.wait(timeout=5)
+    except Exception:
+      self.kill()
+
+
+class Pyttsx3Backend(TTSBackend):
+  """Offline backend backed by a pool of warm pyttsx3 engine processes.
+
+  Engines are started up front so requests never pay driver start-up, and
+  each runs in its own process so concurrent replies don't serialize on one
+  driver. An engine that hangs or dies is killed and replaced.
+  """
+  name = "pyttsx3"
+
+  def __init__(self, pool_size=TTS_POOL_SIZE, rate=TTS_RATE, voice=TTS_VOICE, lang=TTS_LANG,
+               driver=os.getenv("TTS_DRIVER"), timeout=TTS_TIMEOUT):
+    import pyttsx3  # fail here, with a clear ImportError, rather than inside every worker
+    self.config = {"driver": driver or _default_driver(), "rate": rate, "voice": voice, "lang": lang}
+    self.timeout = timeout
+    self._idle = queue.Queue()
+    self._engines = []
+    # Surface driver errors (missing espeak-ng etc.) at startup, not on first reply
+    for i in range(max(1, pool_size)):
+      engine = EngineProcess(self.config, i, timeout)
+      self._engines.append(engine)
+      self._idle.put(engine)
+
+  def _replace(self, engine):
+    print(f"♻️ Restarting pyttsx3 engine {engine.index}")
+    fresh = EngineProcess(self.config, engine.index, self.timeout)
+    self._engines[engine.index] = fresh
+    return fresh
+
+  def synthesize(self, text):
+    try:
+      engine = self._idle.get(timeout=self.timeout)
+    except queue.Empty:
+      raise TimeoutError(f"No pyttsx3 engine free after {self.timeout:.0f}s")
+    wav_path = None
+    try:
+      if not engine.alive:
+        engine = self._replace(engine)  # an earlier restart failed, retry it now
+      fd, wav_path = tempfile.mkstemp(suffix=".wav")
+      os.close(fd)
+      try:
+        engine.run(text, wav_path)
+      except Exception:
+        # A timed-out engine was already killed; one that only reported an
+        # error may be wedged too, so start from a clean process either way
+        engine.kill()
+        try:
+          engine = self._replace(engine)
+        except Exception as e:
+          print(f"❌ Could not restart pyttsx3 engine {engine.index}: {e}")
+        raise
+      return AudioSegment.from_file(wav_path, format="wav")
+    finally:
+      # The engine has finished or been killed, so nothing can still write the file
+      if wav_path:
+        try:
+          os.remove(wav_path)
+        except OSError:
+          pass
+      # Dead engines go back too, so the pool never shrinks
+      self._idle.put(engine)
+
+  def close(self):
+    for engine in self._engines:
+      engine.close()
+
+
+BACKENDS = {
+  GTTSBackend.name: GTTSBackend,
+  Pyttsx3Backend.name: Pyttsx3Backend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_backend(name=None):
+  """Return the (shared, lazily built) backend instance for `name`."""
+  name = (name or TTS_BACKEND).lower()
+  if name not in BACKENDS:
+    raise ValueError(f"Unknown TTS backend '{name}', choose one of: {', '.join(BACKENDS)}")
+  with _backends_lock:
+    backend = _backends.get(name)
+    if backend is None:
+      backend = BACKENDS[name]()
+      _backends[name] = backend
+    return backend
+
+
+def _record(name, seconds, ok):
+  with _stats_lock:
+    s = _stats.setdefault(name, {"calls": 0, "errors": 0, "total_s": 0.0, "min_s": None, "max_s": 0.0, "last_s": None})
+    s["calls"] += 1
+    if not ok:
+      s["errors"] += 1
+      return
+    s["total_s"] += seconds
+    s["last_s"] = seconds
+    s["max_s"] = max(s["max_s"], seconds)
+    s["min_s"] = seconds if s["min_s"] is None else min(s["min_s"], seconds)
+
+
+def tts_stats():
+  """Per-backend latency figures so local and cloud paths can be compared."""
+  with _stats_lock:
+    out = {}
+    for name, s in _stats.items():
+      ok_calls = s["calls"] - s["errors"]
+      out[name] = dict(s, avg_s=(s["total_s"] / ok_calls) if ok_calls else None)
+    return {"active": TTS_BACKEND, "backends": out}
+
+
+def text_to_speech(text, response_audio_path, backend=None):
+  engine = get_backend(backend)
+  t_start = time.perf_counter()
+  ok = False
+  try:
+    with span("tts.synthesize", backend=engine.name):
+      sound = engine.synthesize(text)
+    with span("tts.export"):
+      sound = sound.set_frame_rate(OUTPUT_FRAME_RATE).set_sample_width(OUTPUT_SAMPLE_WIDTH)
+      sound.export(response_audio_path, format="wav")
+    ok = True
+  finally:
+    elapsed = time.perf_counter() - t_start
+    _record(engine.name, elapsed, ok)
+  print(f"🔊 TTS ({engine.name}): {elapsed:.2f}s")
+  return
+
+
+# Warm the configured backend now so the first reply doesn't pay for it
+get_backend()
+print ("TTS setup is done ✅")
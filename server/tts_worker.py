@@ -0,0 +1,87 @@
+"""One pyttsx3 engine in its own process, driven by server/tts.py.
+
+Run as a script (never imported through the `server` package, which would
+load Whisper and Gemini). Reads one JSON job per line on stdin and answers
+with one JSON line on stdout:
+  config (argv[1]): {"driver", "rate", "voice", "lang"}
+  job:              {"text", "path"}
+  reply:            {"status": "ready" | "ok" | "error", "error"?}
+"""
+import json
+import os
+import sys
+
+
+def _voice_languages(voice):
+  # eSpeak reports languages as bytes prefixed with a priority byte, e.g. b"\x05hi"
+  for lang in getattr(voice, "languages", None) or []:
+    if isinstance(lang, bytes):
+      lang = lang[1:].decode("utf-8", "ignore")
+    yield str(lang).lower().replace("_", "-")
+
+
+def _voice_for_lang(engine, lang):
+  """Id of the first installed voice speaking `lang`, or None."""
+  lang = lang.lower()
+  for voice in engine.getProperty("voices"):
+    if any(l == lang or l.startswith(lang + "-") for l in _voice_languages(voice)):
+      return voice.id
+    if voice.id.lower().rsplit("/", 1)[-1] == lang:
+      return voice.id
+  return None
+
+
+def _new_engine(config):
+  try:
+    import pythoncom  # Windows only: SAPI5 needs COM on this thread
+    pythoncom.CoInitialize()
+  except ImportError:
+    pass
+  import pyttsx3
+  # pyttsx3.init() hands back one shared engine per driver, so build our own
+  engine = pyttsx3.Engine(config["driver"])
+  if config.get("rate"):
+    engine.setProperty("rate", int(config["rate"]))
+  voice = config.get("voice") or (config.get("lang") and _voice_for_lang(engine, config["lang"]))
+  if voice:
+    engine.setProperty("voice", voice)
+  elif config.get("lang"):
+    print(f"⚠️ No pyttsx3 voice found for language '{config['lang']}', using the default voice", file=sys.stderr)
+  return engine
+
+
+def main():
+  # stdout carries the protocol; anything the drivers print (from Python or
+  # from C, e.g. libespeak) goes to stderr
+  reply_to = os.fdopen(os.dup(1), "w", encoding="utf-8")
+  os.dup2(2, 1)
+  sys.stdout = sys.stderr
+
+  def reply(status, error=None):
+    msg = {"status": status}
+    if error is not None:
+      msg["error"] = error
+    reply_to.write(json.dumps(msg) + "\n")
+    reply_to.flush()
+
+  try:
+    engine = _new_engine(json.loads(sys.argv[1]))
+  except Exception as e:
+    reply("error", repr(e))
+    return
+  reply("ready")
+
+  for line in sys.stdin:
+    if not line.strip():
+      continue
+    job = json.loads(line)
+    try:
+      engine.save_to_file(job["text"], job["path"])
+      engine.runAndWait()
+      reply("ok")
+    except Exception as e:
+      reply("error", repr(e))
+
+
+if __name__ == "__main__":
+  main()